@@ -0,0 +1,620 @@
+import os
+import time
+import queue
+import argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from main import load_dicom_series, sitk_to_vtk, create_volume_property
+
+# --- Brick-partitioned CPU volume rendering ---
+#
+# Without a GPU, vtkSmartVolumeMapper falls back to a single CPU ray caster for
+# the whole volume. Here the volume is split into a grid of bricks, each brick
+# is ray cast into a partial RGBA image by a worker process reading the voxels
+# from a shared-memory buffer, and the partial images are depth sorted and
+# composited with the "over" operator into the final frame.
+
+BACKGROUND = (0.03, 0.03, 0.08)
+
+_worker = {}
+
+
+# --- Brick Partitioning ---
+
+def split_counts(dims, n_bricks):
+    # Factor the brick count across the three axes, picking the split whose
+    # bricks are closest to cubes (shortest edges, longest first). Each axis
+    # keeps at least 2 cells per brick; if the count can't be factored that
+    # way, fall back to the largest count below it that can.
+    for n in range(n_bricks, 0, -1):
+        best = None
+        for cx in range(1, n + 1):
+            if n % cx:
+                continue
+            for cy in range(1, n // cx + 1):
+                if (n // cx) % cy:
+                    continue
+                counts = (cx, cy, n // (cx * cy))
+                if any((dims[a] - 1) // counts[a] < 2 for a in range(3)):
+                    continue
+                edge = sorted(((dims[a] - 1) / counts[a] for a in range(3)), reverse=True)
+                if best is None or edge < best[0]:
+                    best = (edge, counts)
+        if best is not None:
+            return list(best[1])
+    return [1, 1, 1]
+
+
+def partition_bricks(dims, counts):
+    # Neighbouring bricks share their boundary plane of points, so together
+    # they cover the volume cells exactly once.
+    edges = [
+        np.linspace(0, dims[a] - 1, counts[a] + 1).round().astype(int)
+        for a in range(3)
+    ]
+    bricks = []
+    for k in range(counts[2]):
+        for j in range(counts[1]):
+            for i in range(counts[0]):
+                index = (i, j, k)
+                owned = []
+                for a in range(3):
+                    owned += [int(edges[a][index[a]]), int(edges[a][index[a] + 1])]
+                bricks.append({"index": index, "extent": tuple(owned)})
+    return bricks, edges
+
+
+def order_back_to_front(bricks, edges, spacing, origin, camera):
+    # For an axis-aligned brick grid, the Manhattan distance (in bricks) from
+    # the brick holding the eye is a valid visibility order. A parallel
+    # projection has its eye at infinity against the direction of projection,
+    # so a point far enough back along it gives the same order.
+    eye = np.asarray(camera["position"], dtype=float)
+    if camera["parallel_projection"]:
+        focal = np.asarray(camera["focal_point"], dtype=float)
+        direction = focal - eye
+        direction /= np.linalg.norm(direction)
+        span = max(
+            abs(origin[a] + edges[a][-1] * spacing[a] - focal[a])
+            + abs(origin[a] + edges[a][0] * spacing[a] - focal[a])
+            for a in range(3)
+        )
+        eye = focal - direction * span * 1e3
+
+    eye_index = []
+    for a in range(3):
+        planes = origin[a] + edges[a] * spacing[a]
+        slab = int(np.searchsorted(planes, eye[a])) - 1
+        eye_index.append(min(max(slab, 0), len(planes) - 2))
+
+    def distance(brick):
+        return sum(abs(brick["index"][a] - eye_index[a]) for a in range(3))
+
+    return sorted(bricks, key=distance, reverse=True)
+
+
+# --- Camera Helpers ---
+
+def camera_state(camera):
+    return {
+        "position": camera.GetPosition(),
+        "focal_point": camera.GetFocalPoint(),
+        "view_up": camera.GetViewUp(),
+        "view_angle": camera.GetViewAngle(),
+        "clipping_range": camera.GetClippingRange(),
+        "parallel_projection": camera.GetParallelProjection(),
+        "parallel_scale": camera.GetParallelScale(),
+    }
+
+
+def apply_camera_state(camera, state):
+    camera.SetPosition(state["position"])
+    camera.SetFocalPoint(state["focal_point"])
+    camera.SetViewUp(state["view_up"])
+    camera.SetViewAngle(state["view_angle"])
+    camera.SetClippingRange(state["clipping_range"])
+    camera.SetParallelProjection(state["parallel_projection"])
+    camera.SetParallelScale(state["parallel_scale"])
+
+
+def create_cpu_mapper(threads=None):
+    # Fixed settings shared by the brick renders and the reference render so
+    # their images stay pixel-comparable.
+    mapper = vtk.vtkFixedPointVolumeRayCastMapper()
+    mapper.AutoAdjustSampleDistancesOff()
+    mapper.SetImageSampleDistance(1.0)
+    if threads is not None:
+        mapper.SetNumberOfThreads(threads)
+    return mapper
+
+
+def create_offscreen_window(size):
+    renderer = vtk.vtkRenderer()
+    renderer.SetBackground(0.0, 0.0, 0.0)
+    renderer.SetBackgroundAlpha(0.0)
+
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetAlphaBitPlanes(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(*size)
+    return render_window, renderer
+
+
+def read_rgba(render_window, x0, y0, x1, y1):
+    # Premultiplied RGBA rendered over a transparent black background.
+    pixels = vtk.vtkFloatArray()
+    render_window.GetRGBAPixelData(x0, y0, x1, y1, 0, pixels)
+    rgba = numpy_support.vtk_to_numpy(pixels)
+    return rgba.reshape(y1 - y0 + 1, x1 - x0 + 1, 4).copy()
+
+
+# --- Worker Process ---
+
+def _init_worker(shm_name, shape, spacing, origin, sample_distance):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    voxels = np.ndarray(shape, dtype=np.uint16, buffer=shm.buf)
+    _worker["shm"] = shm
+    _worker["voxels"] = voxels
+    _worker["spacing"] = spacing
+    _worker["origin"] = origin
+    _worker["properties"] = {}
+    _worker["window"] = None
+
+    # The mapper reads the whole volume straight out of shared memory, with
+    # no copy. Bricks are cut out with clipping planes rather than by giving
+    # the mapper a sub-volume: the ray caster keeps its samples at the
+    # positions it would use for the full volume, so ray segments meet
+    # seamlessly at brick faces. Cropping or a sub-volume input would restart
+    # sampling at every face.
+    image = vtk.vtkImageData()
+    image.SetDimensions(shape[2], shape[1], shape[0])
+    image.SetSpacing(spacing)
+    image.SetOrigin(origin)
+    image.GetPointData().SetScalars(
+        numpy_support.numpy_to_vtk(voxels.ravel(), deep=False, array_type=vtk.VTK_UNSIGNED_SHORT)
+    )
+
+    # One process per brick already keeps the cores busy.
+    mapper = create_cpu_mapper(threads=1)
+    mapper.SetSampleDistance(sample_distance)
+    mapper.SetInputData(image)
+
+    volume = vtk.vtkVolume()
+    volume.SetMapper(mapper)
+    _worker["image"] = image
+    _worker["mapper"] = mapper
+    _worker["volume"] = volume
+
+
+def _clip_to_brick(extent):
+    spacing = _worker["spacing"]
+    origin = _worker["origin"]
+    mapper = _worker["mapper"]
+    mapper.RemoveAllClippingPlanes()
+    for a in range(3):
+        for index, sign in ((extent[2 * a], 1.0), (extent[2 * a + 1], -1.0)):
+            point = [0.0, 0.0, 0.0]
+            normal = [0.0, 0.0, 0.0]
+            point[a] = origin[a] + index * spacing[a]
+            normal[a] = sign
+            plane = vtk.vtkPlane()
+            plane.SetOrigin(point)
+            plane.SetNormal(normal)
+            mapper.AddClippingPlane(plane)
+
+
+def _screen_rect(renderer, extent, size):
+    spacing = _worker["spacing"]
+    origin = _worker["origin"]
+    xs, ys = [], []
+    for x in extent[0:2]:
+        for y in extent[2:4]:
+            for z in extent[4:6]:
+                renderer.SetWorldPoint(
+                    origin[0] + x * spacing[0],
+                    origin[1] + y * spacing[1],
+                    origin[2] + z * spacing[2],
+                    1.0,
+                )
+                renderer.WorldToDisplay()
+                display = renderer.GetDisplayPoint()
+                xs.append(display[0])
+                ys.append(display[1])
+    x0 = min(max(int(np.floor(min(xs))) - 1, 0), size[0] - 1)
+    x1 = min(max(int(np.ceil(max(xs))) + 1, 0), size[0] - 1)
+    y0 = min(max(int(np.floor(min(ys))) - 1, 0), size[1] - 1)
+    y1 = min(max(int(np.ceil(max(ys))) + 1, 0), size[1] - 1)
+    return x0, y0, x1, y1
+
+
+def _render_brick(extent, camera, size, scales):
+    window = _worker["window"]
+    if window is None or window[0].GetSize() != tuple(size):
+        window = create_offscreen_window(size)
+        window[1].AddVolume(_worker["volume"])
+        _worker["window"] = window
+    render_window, renderer = window
+
+    volume_property = _worker["properties"].get(scales)
+    if volume_property is None:
+        volume_property = create_volume_property(*scales)
+        _worker["properties"][scales] = volume_property
+
+    _worker["volume"].SetProperty(volume_property)
+    _clip_to_brick(extent)
+    apply_camera_state(renderer.GetActiveCamera(), camera)
+    render_window.Render()
+
+    # Only the brick's screen footprint is shipped back to the parent.
+    x0, y0, x1, y1 = _screen_rect(renderer, extent, size)
+    return extent, x0, y0, read_rgba(render_window, x0, y0, x1, y1)
+
+
+def _worker_loop(shm_name, shape, spacing, origin, extents, sample_distance, camera, tasks, results):
+    # Each worker owns a fixed set of bricks for its whole life. One small
+    # render at startup makes the mapper compute its gradient tables, so the
+    # first interactive frame isn't slowed down by it.
+    try:
+        _init_worker(shm_name, shape, spacing, origin, sample_distance)
+        _render_brick(extents[0], camera, (16, 16), (0.5, 0.5))
+    except Exception as e:
+        results.put(RuntimeError(f"brick worker failed to start: {e}"))
+        return
+    results.put("ready")
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        camera, size, scales = task
+        for extent in extents:
+            try:
+                results.put(_render_brick(extent, camera, size, scales))
+            except Exception as e:
+                results.put(RuntimeError(f"brick {extent} failed: {e}"))
+
+
+# --- Parallel Renderer ---
+
+class BrickRenderer:
+    def __init__(self, vtk_image, workers, n_bricks=None):
+        dims = vtk_image.GetDimensions()
+        self.spacing = vtk_image.GetSpacing()
+        self.origin = vtk_image.GetOrigin()
+        self.sample_distance = min(self.spacing)
+
+        counts = split_counts(dims, n_bricks or workers)
+        self.bricks, self.edges = partition_bricks(dims, counts)
+        workers = min(workers, len(self.bricks))
+        print(f"🧱 {len(self.bricks)} bricks ({counts[0]}x{counts[1]}x{counts[2]}) on {workers} workers")
+
+        voxels = numpy_support.vtk_to_numpy(vtk_image.GetPointData().GetScalars())
+        shape = (dims[2], dims[1], dims[0])
+        self.shm = shared_memory.SharedMemory(create=True, size=voxels.nbytes)
+        self.processes = []
+        try:
+            shared = np.ndarray(shape, dtype=np.uint16, buffer=self.shm.buf)
+            shared[...] = voxels.reshape(shape)
+            del shared
+
+            # Spawned workers never inherit the parent's OpenGL context. Brick
+            # i always goes to worker i % workers.
+            context = mp.get_context("spawn")
+            warm_up_camera = default_camera(vtk_image, (16, 16))
+            self.results = context.Queue()
+            self.tasks = []
+            for w in range(workers):
+                extents = [brick["extent"] for brick in self.bricks[w::workers]]
+                tasks = context.Queue()
+                process = context.Process(
+                    target=_worker_loop,
+                    args=(self.shm.name, shape, self.spacing, self.origin,
+                          extents, self.sample_distance, warm_up_camera,
+                          tasks, self.results),
+                    daemon=True,
+                )
+                process.start()
+                self.tasks.append(tasks)
+                self.processes.append(process)
+
+            for _ in self.processes:
+                self._get_result()
+        except BaseException:
+            self.close()
+            raise
+
+    def _get_result(self):
+        while True:
+            try:
+                result = self.results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("a brick worker exited unexpectedly")
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def render(self, camera, size, scales=(0.5, 0.5)):
+        task = (camera, tuple(size), tuple(scales))
+        for tasks in self.tasks:
+            tasks.put(task)
+
+        # Collect every partial image even if one failed, so no stale result
+        # is left in the queue for the next frame.
+        partials = {}
+        error = None
+        for _ in self.bricks:
+            try:
+                extent, x0, y0, rgba = self._get_result()
+                partials[extent] = (x0, y0, rgba)
+            except RuntimeError as e:
+                error = e
+        if error is not None:
+            raise error
+
+        frame = np.zeros((size[1], size[0], 4), dtype=np.float32)
+        ordered = order_back_to_front(
+            self.bricks, self.edges, self.spacing, self.origin, camera
+        )
+        for brick in ordered:
+            x0, y0, rgba = partials[brick["extent"]]
+            h, w = rgba.shape[:2]
+            region = frame[y0:y0 + h, x0:x0 + w]
+            region *= 1.0 - rgba[..., 3:4]
+            region += rgba
+        return frame
+
+    def close(self):
+        for process, tasks in zip(self.processes, getattr(self, "tasks", [])):
+            if process.is_alive():
+                tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ReferenceRenderer:
+    # The single-mapper CPU render that the brick composite must match. It is
+    # kept alive between frames so timings don't include window and mapper
+    # setup.
+    def __init__(self, vtk_image, size, scales=(0.5, 0.5)):
+        self.size = tuple(size)
+        self.render_window, self.renderer = create_offscreen_window(size)
+        mapper = create_cpu_mapper()
+        mapper.SetSampleDistance(min(vtk_image.GetSpacing()))
+        mapper.SetInputData(vtk_image)
+
+        volume = vtk.vtkVolume()
+        volume.SetMapper(mapper)
+        volume.SetProperty(create_volume_property(*scales))
+        self.renderer.AddVolume(volume)
+
+    def render(self, camera):
+        apply_camera_state(self.renderer.GetActiveCamera(), camera)
+        self.render_window.Render()
+        return read_rgba(self.render_window, 0, 0, self.size[0] - 1, self.size[1] - 1)
+
+
+def to_rgb(frame, background=BACKGROUND):
+    rgb = frame[..., :3] + (1.0 - frame[..., 3:4]) * np.asarray(background, dtype=np.float32)
+    return (np.clip(rgb, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def default_camera(vtk_image, size, dolly=None, parallel=False):
+    renderer = vtk.vtkRenderer()
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(*size)
+    bounds = vtk_image.GetBounds()
+    renderer.ResetCamera(bounds)
+    camera = renderer.GetActiveCamera()
+    camera.Azimuth(30)
+    camera.Elevation(20)
+    if parallel:
+        camera.ParallelProjectionOn()
+    if dolly is not None:
+        camera.Dolly(dolly)
+        if parallel:
+            camera.SetParallelScale(camera.GetParallelScale() / dolly)
+    renderer.ResetCameraClippingRange(bounds)
+    return camera_state(camera)
+
+
+def comparison_cameras(vtk_image, size):
+    # Whole-volume, zoomed-in, inside-the-volume and parallel views, so seams
+    # are checked at every scale rather than only from one pose.
+    return {
+        "default": default_camera(vtk_image, size),
+        "zoom x3": default_camera(vtk_image, size, dolly=3),
+        "zoom x6": default_camera(vtk_image, size, dolly=6),
+        "inside": default_camera(vtk_image, size, dolly=12),
+        "parallel x3": default_camera(vtk_image, size, dolly=3, parallel=True),
+    }
+
+
+# --- Comparison Against the Single Mapper ---
+
+def compare_with_reference(vtk_image, brick_renderer, size, cameras=None):
+    # Both renderers draw one untimed frame first so only steady-state frame
+    # time is compared. The partial images are 8-bit per brick, so the
+    # composite can differ from the single mapper by a few levels.
+    if cameras is None:
+        cameras = comparison_cameras(vtk_image, size)
+    reference_renderer = ReferenceRenderer(vtk_image, size)
+
+    results = {}
+    for name, camera in cameras.items():
+        reference_renderer.render(camera)
+        start = time.perf_counter()
+        reference = to_rgb(reference_renderer.render(camera))
+        reference_time = time.perf_counter() - start
+
+        brick_renderer.render(camera, size)
+        start = time.perf_counter()
+        bricked = to_rgb(brick_renderer.render(camera, size))
+        brick_time = time.perf_counter() - start
+
+        diff = np.abs(reference.astype(np.int16) - bricked.astype(np.int16)).max(axis=-1)
+        stats = {
+            "reference_time": reference_time,
+            "brick_time": brick_time,
+            "max": int(diff.max()),
+            "mean": float(diff.mean()),
+            "off_by_more_than_2": float((diff > 2).mean()),
+        }
+        results[name] = stats
+        print(f"🔍 {name}: single mapper {reference_time:.3f}s, bricks {brick_time:.3f}s, "
+              f"max diff {stats['max']}, mean {stats['mean']:.3f}, "
+              f"{stats['off_by_more_than_2'] * 100:.2f}% of pixels off by more than 2")
+    return results
+
+
+def measure_scaling(vtk_image, worker_counts, size, n_bricks=None, frames=3):
+    # Brick frame time for each worker count, one brick per worker unless
+    # n_bricks is given, relative to the first count.
+    camera = default_camera(vtk_image, size)
+    timings = {}
+    for workers in worker_counts:
+        brick_renderer = BrickRenderer(vtk_image, workers, n_bricks)
+        try:
+            brick_renderer.render(camera, size)
+            start = time.perf_counter()
+            for _ in range(frames):
+                brick_renderer.render(camera, size)
+            timings[workers] = (time.perf_counter() - start) / frames
+        finally:
+            brick_renderer.close()
+
+    base = timings[worker_counts[0]]
+    for workers, frame_time in timings.items():
+        print(f"⏱️ {workers} workers: {frame_time:.3f}s per frame ({base / frame_time:.2f}x)")
+    return timings
+
+
+# --- Interactive Viewer ---
+
+def to_vtk_rgb_image(rgb):
+    h, w = rgb.shape[:2]
+    vtk_array = numpy_support.numpy_to_vtk(
+        rgb.reshape(-1, 3), deep=True, array_type=vtk.VTK_UNSIGNED_CHAR
+    )
+    image = vtk.vtkImageData()
+    image.SetDimensions(w, h, 1)
+    image.GetPointData().SetScalars(vtk_array)
+    return image
+
+
+def visualize_bricked(vtk_image, brick_renderer):
+    # The window only draws the volume outline for camera feedback while
+    # dragging; each composited frame is shown as the background texture.
+    outline = vtk.vtkOutlineFilter()
+    outline.SetInputData(vtk_image)
+    outline_mapper = vtk.vtkPolyDataMapper()
+    outline_mapper.SetInputConnection(outline.GetOutputPort())
+    outline_actor = vtk.vtkActor()
+    outline_actor.SetMapper(outline_mapper)
+    outline_actor.GetProperty().SetColor(0.93, 0.57, 0.13)
+
+    texture = vtk.vtkTexture()
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(outline_actor)
+    renderer.SetBackground(*BACKGROUND)
+    renderer.SetBackgroundTexture(texture)
+
+    render_window = vtk.vtkRenderWindow()
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(1000, 1000)
+
+    interactor = vtk.vtkRenderWindowInteractor()
+    interactor.SetRenderWindow(render_window)
+    interactor.Initialize()
+    renderer.ResetCamera()
+    render_window.Render()
+
+    def update_frame(obj=None, event=None):
+        size = render_window.GetSize()
+        camera = renderer.GetActiveCamera()
+        renderer.ResetCameraClippingRange(vtk_image.GetBounds())
+        start = time.perf_counter()
+        frame = brick_renderer.render(camera_state(camera), size)
+        print(f"🖼️ Frame composited in {time.perf_counter() - start:.3f}s")
+        texture.SetInputData(to_vtk_rgb_image(to_rgb(frame)))
+        renderer.TexturedBackgroundOn()
+        render_window.Render()
+
+    def start_interaction(obj, event):
+        renderer.TexturedBackgroundOff()
+
+    style = interactor.GetInteractorStyle()
+    style.AddObserver("StartInteractionEvent", start_interaction)
+    style.AddObserver("EndInteractionEvent", update_frame)
+
+    update_frame()
+    interactor.Start()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Brick-parallel CPU volume rendering")
+    parser.add_argument("--dicom-dir", default=os.path.join(os.getcwd(), "Sample_DICOM"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--bricks", type=int, default=None,
+                        help="number of bricks (defaults to the number of workers)")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare against the single mapper offscreen and time "
+                             "several worker counts")
+    parser.add_argument("--scaling", type=int, nargs="+", default=None,
+                        help="worker counts timed by --compare "
+                             "(defaults to powers of two up to --workers)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    brick_renderer = None
+    try:
+        print(f"📂 Reading from: {args.dicom_dir}")
+        sitk_img = load_dicom_series(args.dicom_dir)
+        print(f"✅ Volume size: {sitk_img.GetSize()}, spacing: {sitk_img.GetSpacing()}")
+
+        vtk_img = sitk_to_vtk(sitk_img)
+        print("✅ Converted to VTK format")
+
+        if args.compare:
+            brick_renderer = BrickRenderer(vtk_img, args.workers, args.bricks)
+            compare_with_reference(vtk_img, brick_renderer, (800, 800))
+            brick_renderer.close()
+            brick_renderer = None
+
+            worker_counts = args.scaling
+            if worker_counts is None:
+                worker_counts = [1 << i for i in range(args.workers.bit_length())]
+                if worker_counts[-1] != args.workers:
+                    worker_counts.append(args.workers)
+            measure_scaling(vtk_img, worker_counts, (800, 800), args.bricks)
+        else:
+            brick_renderer = BrickRenderer(vtk_img, args.workers, args.bricks)
+            visualize_bricked(vtk_img, brick_renderer)
+            print("✅ Viewer closed")
+
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+    finally:
+        if brick_renderer is not None:
+            brick_renderer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -118,22 +118,30 @@ def add_opacity_sliders(interactor, volume_property, render_window):
     slider_tissue.AddObserver("InteractionEvent", slider_callback_tissue)
 
 
-def visualize_3d_volume(vtk_image):
-    mapper = vtk.vtkSmartVolumeMapper()
-    mapper.SetInputData(vtk_image)
-
+def create_color_function():
     color = vtk.vtkColorTransferFunction()
     color.AddRGBPoint(0, 0.0, 0.0, 0.0)
     color.AddRGBPoint(150, 0.4, 0.3, 0.2)
     color.AddRGBPoint(300, 0.5, 0.35, 0.3)
     color.AddRGBPoint(800, 0.9, 0.8, 0.7)
     color.AddRGBPoint(1300, 1.0, 1.0, 1.0)
+    return color
+
 
+def create_volume_property(bone_scale=0.5, tissue_scale=0.5):
     volume_property = vtk.vtkVolumeProperty()
-    volume_property.SetColor(color)
-    volume_property.SetScalarOpacity(create_opacity_function(0.5, 0.5))
+    volume_property.SetColor(create_color_function())
+    volume_property.SetScalarOpacity(create_opacity_function(bone_scale, tissue_scale))
     volume_property.ShadeOn()
     volume_property.SetInterpolationTypeToLinear()
+    return volume_property
+
+
+def visualize_3d_volume(vtk_image):
+    mapper = vtk.vtkSmartVolumeMapper()
+    mapper.SetInputData(vtk_image)
+
+    volume_property = create_volume_property(0.5, 0.5)
 
     volume = vtk.vtkVolume()
     volume.SetMapper(mapper)
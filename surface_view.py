@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from main import load_dicom_series, sitk_to_vtk
+
+# --- Per-bone surface meshes with a level-of-detail cache ---
+#
+# Each bone surface is extracted once and decimated into several LOD levels.
+# The levels are stored on disk under a key built from the volume fingerprint
+# and the iso-threshold. Reopening the same series loads them back instead of
+# contouring again. While viewing, each bone shows the level that fits its
+# on-screen size.
+
+CACHE_DIR = os.path.join(os.getcwd(), ".mesh_cache")
+# Bump when the extraction or decimation code changes in a way the settings
+# stored in the manifest don't capture.
+CACHE_VERSION = 2
+
+# Bone starts around here in the clipped 0-2000 range used by main.py.
+BONE_ISO_THRESHOLD = 1000
+# Smaller connected pieces are noise or loose fragments, not bones.
+MIN_BONE_POINTS = 2000
+
+# Fraction of the full-resolution triangles kept at each LOD level.
+LOD_TRIANGLE_FRACTIONS = (1.0, 0.25, 0.08, 0.02)
+DECIMATION_PRESERVE_VOLUME = True
+# Minimum projected diameter (pixels) for each level; smaller bones fall
+# through to the coarsest level.
+LOD_PIXEL_THRESHOLDS = (500, 200, 60)
+
+BONE_COLORS = [
+    (1.0, 0.2, 0.2),
+    (0.2, 0.2, 1.0),
+    (1.0, 1.0, 0.2),
+    (0.2, 0.9, 0.4),
+    (0.9, 0.4, 0.9),
+    (0.3, 0.9, 0.9),
+]
+
+
+# --- Cache Key ---
+
+def volume_fingerprint(vtk_image):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((
+        vtk_image.GetDimensions(), vtk_image.GetSpacing(), vtk_image.GetOrigin()
+    )).encode())
+    voxels = numpy_support.vtk_to_numpy(vtk_image.GetPointData().GetScalars())
+    digest.update(np.ascontiguousarray(voxels).data)
+    return digest.hexdigest()
+
+
+def cache_path(fingerprint, threshold, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{fingerprint}_iso{threshold:g}")
+
+
+# --- Surface Extraction ---
+
+def extract_bone_surfaces(vtk_image, threshold):
+    print(f"🦴 Extracting bone surfaces at iso {threshold:g}...")
+    contour = vtk.vtkFlyingEdges3D()
+    contour.SetInputData(vtk_image)
+    contour.SetValue(0, threshold)
+    contour.ComputeNormalsOff()
+    contour.ComputeGradientsOff()
+
+    # Every bone is its own connected piece of the iso-surface.
+    connectivity = vtk.vtkPolyDataConnectivityFilter()
+    connectivity.SetInputConnection(contour.GetOutputPort())
+    connectivity.SetExtractionModeToAllRegions()
+    connectivity.ColorRegionsOn()
+    connectivity.Update()
+
+    sizes = numpy_support.vtk_to_numpy(connectivity.GetRegionSizes())
+    regions = [r for r in np.argsort(sizes)[::-1] if sizes[r] >= MIN_BONE_POINTS]
+
+    bones = []
+    for region in regions:
+        threshold_filter = vtk.vtkThreshold()
+        threshold_filter.SetInputConnection(connectivity.GetOutputPort())
+        threshold_filter.SetInputArrayToProcess(
+            0, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS, "RegionId"
+        )
+        threshold_filter.SetLowerThreshold(region)
+        threshold_filter.SetUpperThreshold(region)
+        threshold_filter.SetThresholdFunction(vtk.vtkThreshold.THRESHOLD_BETWEEN)
+
+        surface = vtk.vtkGeometryFilter()
+        surface.SetInputConnection(threshold_filter.GetOutputPort())
+        surface.Update()
+
+        bone = vtk.vtkPolyData()
+        bone.DeepCopy(surface.GetOutput())
+        bone.GetPointData().RemoveArray("RegionId")
+        bone.GetCellData().RemoveArray("RegionId")
+        bones.append(bone)
+
+    print(f"✅ Found {len(bones)} bones")
+    return bones
+
+
+def build_lod_levels(surface):
+    # Each level is decimated from the previous one, which is much cheaper than
+    # decimating the full-resolution mesh every time.
+    levels = []
+    current = surface
+    previous_fraction = 1.0
+    for fraction in LOD_TRIANGLE_FRACTIONS:
+        if fraction < previous_fraction:
+            decimate = vtk.vtkQuadricDecimation()
+            decimate.SetInputData(current)
+            decimate.SetTargetReduction(1.0 - fraction / previous_fraction)
+            decimate.SetVolumePreservation(DECIMATION_PRESERVE_VOLUME)
+            decimate.Update()
+            current = decimate.GetOutput()
+            previous_fraction = fraction
+
+        normals = vtk.vtkPolyDataNormals()
+        normals.SetInputData(current)
+        normals.SplittingOff()
+        normals.ConsistencyOn()
+        normals.Update()
+
+        level = vtk.vtkPolyData()
+        level.DeepCopy(normals.GetOutput())
+        levels.append(level)
+    return levels
+
+
+# --- Mesh Cache ---
+
+def mesh_settings(threshold):
+    # Everything that shapes the cached meshes. A cache entry built with
+    # different settings is treated as a miss.
+    return {
+        "version": CACHE_VERSION,
+        "threshold": threshold,
+        "min_bone_points": MIN_BONE_POINTS,
+        "lod_fractions": list(LOD_TRIANGLE_FRACTIONS),
+        "decimation_preserve_volume": DECIMATION_PRESERVE_VOLUME,
+    }
+
+
+def load_cached_bones(path, settings):
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+
+    # A damaged entry (bad manifest, missing or empty mesh files) is a cache
+    # miss: the meshes are rebuilt and the entry rewritten.
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("settings") != settings:
+            return None
+
+        bones = []
+        for bone in manifest["bones"]:
+            levels = []
+            for file_name in bone["levels"]:
+                file_path = os.path.join(path, file_name)
+                if not os.path.isfile(file_path):
+                    return None
+                reader = vtk.vtkXMLPolyDataReader()
+                reader.SetFileName(file_path)
+                reader.Update()
+                level = reader.GetOutput()
+                if level is None or level.GetNumberOfCells() == 0:
+                    return None
+                levels.append(level)
+            if len(levels) != len(LOD_TRIANGLE_FRACTIONS):
+                return None
+            bones.append(levels)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return bones
+
+
+def save_cached_bones(path, bones, settings):
+    # Write into a scratch directory next to the entry and move it into place
+    # last, so an interrupted run never leaves a half-written entry behind.
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=cache_dir)
+    manifest = {"settings": settings, "bones": []}
+    for b, levels in enumerate(bones):
+        names = []
+        for lod, level in enumerate(levels):
+            name = f"bone_{b:02d}_lod{lod}.vtp"
+            writer = vtk.vtkXMLPolyDataWriter()
+            writer.SetFileName(os.path.join(scratch, name))
+            writer.SetInputData(level)
+            writer.SetDataModeToAppended()
+            writer.SetCompressorTypeToZLib()
+            writer.Write()
+            names.append(name)
+        manifest["bones"].append({
+            "levels": names,
+            "triangles": [level.GetNumberOfCells() for level in levels],
+        })
+    with open(os.path.join(scratch, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(scratch, path)
+
+
+def get_bone_meshes(vtk_image, threshold=BONE_ISO_THRESHOLD, max_bones=None, cache_dir=CACHE_DIR):
+    # The cache always holds every bone, largest first; max_bones only limits
+    # what is returned, so runs with different limits share one entry.
+    path = cache_path(volume_fingerprint(vtk_image), threshold, cache_dir)
+    settings = mesh_settings(threshold)
+    start = time.perf_counter()
+    bones = load_cached_bones(path, settings)
+    if bones is not None:
+        print(f"⚡ Loaded {len(bones)} cached bone meshes in {time.perf_counter() - start:.2f}s")
+    else:
+        surfaces = extract_bone_surfaces(vtk_image, threshold)
+        bones = [build_lod_levels(surface) for surface in surfaces]
+        save_cached_bones(path, bones, settings)
+        print(f"💾 Built and cached bone meshes in {time.perf_counter() - start:.2f}s")
+
+    if max_bones is not None:
+        bones = bones[:max_bones]
+    return bones
+
+
+# --- Screen-Space LOD Selection ---
+
+def projected_diameter(renderer, bounds):
+    # Diameter in pixels of the bounding sphere of `bounds` under the active
+    # camera.
+    camera = renderer.GetActiveCamera()
+    height = renderer.GetSize()[1]
+    center = np.array([
+        (bounds[0] + bounds[1]) / 2,
+        (bounds[2] + bounds[3]) / 2,
+        (bounds[4] + bounds[5]) / 2,
+    ])
+    radius = 0.5 * np.linalg.norm([
+        bounds[1] - bounds[0], bounds[3] - bounds[2], bounds[5] - bounds[4]
+    ])
+    if camera.GetParallelProjection():
+        return radius / camera.GetParallelScale() * height
+
+    distance = np.linalg.norm(center - np.array(camera.GetPosition()))
+    if distance <= radius:
+        return float("inf")
+    half_angle = np.radians(camera.GetViewAngle()) / 2
+    return radius / (distance * np.tan(half_angle)) * height
+
+
+def select_lod(diameter):
+    for level, pixels in enumerate(LOD_PIXEL_THRESHOLDS):
+        if diameter >= pixels:
+            return level
+    return len(LOD_PIXEL_THRESHOLDS)
+
+
+def create_bone_actor(levels, color):
+    mappers = []
+    for level in levels:
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(level)
+        mapper.ScalarVisibilityOff()
+        mappers.append(mapper)
+
+    actor = vtk.vtkActor()
+    actor.SetMapper(mappers[0])
+    actor.GetProperty().SetColor(*color)
+    actor.GetProperty().SetSpecular(0.3)
+    actor.GetProperty().SetSpecularPower(20)
+    return actor, mappers
+
+
+# --- Visualization Loop ---
+
+def visualize_bone_surfaces(bones):
+    renderer = vtk.vtkRenderer()
+    renderer.SetBackground(0.03, 0.03, 0.08)
+
+    bone_actors = []
+    for b, levels in enumerate(bones):
+        actor, mappers = create_bone_actor(levels, BONE_COLORS[b % len(BONE_COLORS)])
+        renderer.AddActor(actor)
+        bone_actors.append((actor, mappers, levels[0].GetBounds()))
+
+    def update_lod(obj, event):
+        for actor, mappers, bounds in bone_actors:
+            level = min(select_lod(projected_diameter(renderer, bounds)), len(mappers) - 1)
+            if actor.GetMapper() is not mappers[level]:
+                actor.SetMapper(mappers[level])
+
+    # Runs before every frame, so the levels follow zooming and rotation.
+    renderer.AddObserver("StartEvent", update_lod)
+
+    render_window = vtk.vtkRenderWindow()
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(1000, 1000)
+
+    interactor = vtk.vtkRenderWindowInteractor()
+    interactor.SetRenderWindow(render_window)
+
+    renderer.ResetCamera()
+    render_window.Render()
+    interactor.Initialize()
+    interactor.Start()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cached per-bone surface viewer")
+    parser.add_argument("--dicom-dir", default=os.path.join(os.getcwd(), "Sample_DICOM"))
+    parser.add_argument("--threshold", type=float, default=BONE_ISO_THRESHOLD,
+                        help="iso-value of the bone surface")
+    parser.add_argument("--max-bones", type=int, default=None,
+                        help="keep only the N largest bones (default: all)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="where extracted bone meshes are cached")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        print(f"📂 Reading from: {args.dicom_dir}")
+        sitk_img = load_dicom_series(args.dicom_dir)
+        print(f"✅ Volume size: {sitk_img.GetSize()}, spacing: {sitk_img.GetSpacing()}")
+
+        vtk_img = sitk_to_vtk(sitk_img)
+        print("✅ Converted to VTK format")
+
+        bones = get_bone_meshes(vtk_img, args.threshold, args.max_bones, args.cache_dir)
+        visualize_bone_surfaces(bones)
+        print("✅ Viewer closed")
+
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+
+
+if __name__ == "__main__":
+    main()
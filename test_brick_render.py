@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+import brick_render
+from main import load_dicom_series, sitk_to_vtk
+
+DICOM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Sample_DICOM")
+
+# Partial images are 8-bit per brick, so the composite can differ from the
+# single mapper by a few levels; seams themselves must not show up.
+MAX_DIFF = 16
+MAX_MEAN_DIFF = 0.5
+MAX_FRACTION_OFF = 0.005
+
+
+def downsampled_sample_volume(factor=2):
+    image = sitk_to_vtk(load_dicom_series(DICOM_DIR))
+    nx, ny, nz = image.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+    voxels = np.ascontiguousarray(voxels.reshape(nz, ny, nx)[::factor, ::factor, ::factor])
+
+    small = vtk.vtkImageData()
+    small.SetDimensions(voxels.shape[2], voxels.shape[1], voxels.shape[0])
+    small.SetSpacing([s * factor for s in image.GetSpacing()])
+    small.SetOrigin(image.GetOrigin())
+    small.GetPointData().SetScalars(
+        numpy_support.numpy_to_vtk(voxels.ravel(), deep=True, array_type=vtk.VTK_UNSIGNED_SHORT)
+    )
+    return small
+
+
+def test_split_counts_uses_exact_brick_count():
+    for n in (1, 3, 5, 12, 24):
+        counts = brick_render.split_counts((512, 512, 350), n)
+        assert counts[0] * counts[1] * counts[2] == n
+
+
+def test_parallel_projection_orders_along_direction_of_projection():
+    bricks, edges = brick_render.partition_bricks((9, 9, 33), (1, 1, 4))
+    # The camera position sits inside the third brick, but with a parallel
+    # projection looking down +z every brick is in front of the one before.
+    camera = {
+        "position": (4.0, 4.0, 20.0),
+        "focal_point": (4.0, 4.0, 30.0),
+        "parallel_projection": 1,
+    }
+    ordered = brick_render.order_back_to_front(bricks, edges, (1, 1, 1), (0, 0, 0), camera)
+    assert [brick["index"][2] for brick in ordered] == [3, 2, 1, 0]
+
+
+@pytest.mark.skipif(not os.path.isdir(DICOM_DIR), reason="sample DICOM series not available")
+@pytest.mark.parametrize("n_bricks", [1, 4, 8])
+def test_bricks_match_single_mapper(n_bricks):
+    image = downsampled_sample_volume()
+    renderer = brick_render.BrickRenderer(image, workers=2, n_bricks=n_bricks)
+    try:
+        results = brick_render.compare_with_reference(image, renderer, (200, 200))
+    finally:
+        renderer.close()
+
+    for name, stats in results.items():
+        if n_bricks == 1:
+            assert stats["max"] == 0, name
+        assert stats["max"] <= MAX_DIFF, name
+        assert stats["mean"] <= MAX_MEAN_DIFF, name
+        assert stats["off_by_more_than_2"] <= MAX_FRACTION_OFF, name
@@ -0,0 +1,146 @@
+import os
+import json
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+import surface_view
+
+THRESHOLD = 1000
+
+
+def two_sphere_volume():
+    # Two separate "bones" of different sizes, so the larger one comes first.
+    z, y, x = np.mgrid[0:32, 0:32, 0:64]
+    voxels = np.zeros(x.shape, dtype=np.uint16)
+    voxels[(x - 16) ** 2 + (y - 16) ** 2 + (z - 16) ** 2 <= 10 ** 2] = 1500
+    voxels[(x - 46) ** 2 + (y - 16) ** 2 + (z - 16) ** 2 <= 7 ** 2] = 1500
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(64, 32, 32)
+    image.SetSpacing(1.0, 1.0, 1.0)
+    image.GetPointData().SetScalars(
+        numpy_support.numpy_to_vtk(voxels.ravel(), deep=True, array_type=vtk.VTK_UNSIGNED_SHORT)
+    )
+    return image
+
+
+@pytest.fixture
+def extract_calls(monkeypatch):
+    # Small test spheres count as bones, and every extraction is recorded so
+    # tests can tell a cache hit from a rebuild.
+    monkeypatch.setattr(surface_view, "MIN_BONE_POINTS", 100)
+    calls = []
+    extract = surface_view.extract_bone_surfaces
+
+    def counting_extract(*args, **kwargs):
+        calls.append(args)
+        return extract(*args, **kwargs)
+
+    monkeypatch.setattr(surface_view, "extract_bone_surfaces", counting_extract)
+    return calls
+
+
+def entry_path(image, cache_dir):
+    return surface_view.cache_path(surface_view.volume_fingerprint(image), THRESHOLD, str(cache_dir))
+
+
+def cell_counts(bones):
+    return [[level.GetNumberOfCells() for level in levels] for levels in bones]
+
+
+def test_cache_round_trip(tmp_path, extract_calls):
+    image = two_sphere_volume()
+    built = surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))
+    loaded = surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))
+
+    assert len(extract_calls) == 1
+    assert len(built) == 2
+    assert all(len(levels) == len(surface_view.LOD_TRIANGLE_FRACTIONS) for levels in built)
+    assert cell_counts(loaded) == cell_counts(built)
+    assert built[0][0].GetNumberOfCells() > built[1][0].GetNumberOfCells()
+
+
+def test_max_bones_shares_one_cache_entry(tmp_path, extract_calls):
+    image = two_sphere_volume()
+    assert len(surface_view.get_bone_meshes(image, THRESHOLD, max_bones=1, cache_dir=str(tmp_path))) == 1
+    assert len(surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))) == 2
+    assert len(extract_calls) == 1
+
+
+def test_settings_mismatch_is_a_miss(tmp_path, extract_calls, monkeypatch):
+    image = two_sphere_volume()
+    surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))
+    path = entry_path(image, tmp_path)
+
+    settings = surface_view.mesh_settings(THRESHOLD)
+    assert surface_view.load_cached_bones(path, settings) is not None
+    assert surface_view.load_cached_bones(path, dict(settings, version=-1)) is None
+
+    monkeypatch.setattr(surface_view, "MIN_BONE_POINTS", 101)
+    surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))
+    assert len(extract_calls) == 2
+
+
+@pytest.mark.parametrize("damage", ["missing vtp", "empty vtp", "bad manifest"])
+def test_damaged_entry_is_rebuilt(tmp_path, extract_calls, damage):
+    image = two_sphere_volume()
+    built = surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))
+    path = entry_path(image, tmp_path)
+
+    if damage == "missing vtp":
+        os.remove(os.path.join(path, "bone_01_lod2.vtp"))
+    elif damage == "empty vtp":
+        open(os.path.join(path, "bone_00_lod1.vtp"), "w").close()
+    else:
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            f.write("{not json")
+
+    rebuilt = surface_view.get_bone_meshes(image, THRESHOLD, cache_dir=str(tmp_path))
+    assert len(extract_calls) == 2
+    assert cell_counts(rebuilt) == cell_counts(built)
+    with open(os.path.join(path, "manifest.json")) as f:
+        assert len(json.load(f)["bones"]) == 2
+
+
+def lod_renderer(size=1000):
+    renderer = vtk.vtkRenderer()
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(size, size)
+    return render_window, renderer
+
+
+# A cube of side 2 has a bounding-sphere radius of sqrt(3).
+BOUNDS = (-1.0, 1.0, -1.0, 1.0, -1.0, 1.0)
+
+
+@pytest.mark.parametrize("distance, level", [(0.5, 0), (10, 0), (20, 1), (50, 2), (200, 3)])
+def test_lod_for_perspective_camera(distance, level):
+    render_window, renderer = lod_renderer()
+    camera = renderer.GetActiveCamera()
+    camera.SetViewAngle(30)
+    camera.SetFocalPoint(0, 0, 0)
+    camera.SetPosition(0, 0, distance)
+
+    diameter = surface_view.projected_diameter(renderer, BOUNDS)
+    if distance > np.sqrt(3):
+        expected = np.sqrt(3) / (distance * np.tan(np.radians(15))) * 1000
+        assert diameter == pytest.approx(expected)
+    assert surface_view.select_lod(diameter) == level
+
+
+@pytest.mark.parametrize("scale, level", [(2, 0), (5, 1), (20, 2), (100, 3)])
+def test_lod_for_parallel_camera(scale, level):
+    render_window, renderer = lod_renderer()
+    camera = renderer.GetActiveCamera()
+    camera.ParallelProjectionOn()
+    camera.SetParallelScale(scale)
+    camera.SetPosition(0, 0, 1000)
+
+    diameter = surface_view.projected_diameter(renderer, BOUNDS)
+    assert diameter == pytest.approx(np.sqrt(3) / scale * 1000)
+    assert surface_view.select_lod(diameter) == level